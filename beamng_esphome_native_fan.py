@@ -4,7 +4,7 @@ import asyncio
 import aioesphomeapi
 from dotenv import load_dotenv
 
-from beamng_utils import subscribe_speed
+from beamng_utils import subscribe_speed_async
 
 load_dotenv()
 
@@ -13,8 +13,25 @@ async def send_esphome_command(fan_speed, api: aioesphomeapi.APIClient, fan):
     await api.fan_command(fan.key, True, speed_level=fan_speed)
 
 
-def set_fan_speed(fan_speed, api, fan):
-    asyncio.run(send_esphome_command(fan_speed, api, fan))
+async def fan_command_worker(api, fan, queue: asyncio.Queue):
+    while True:
+        fan_speed = await queue.get()
+        # Skip intermediate speeds, only the most recent one matters.
+        while not queue.empty():
+            fan_speed = queue.get_nowait()
+        try:
+            await send_esphome_command(fan_speed, api, fan)
+        except aioesphomeapi.APIConnectionError as e:
+            # Exit and let the process supervisor restart (and reconnect) us.
+            print("Failed to send fan speed: {}".format(e))
+            raise
+
+
+def set_fan_speed(fan_speed, queue: asyncio.Queue):
+    # Never block the OutGauge protocol on network I/O.
+    if queue.full():
+        queue.get_nowait()  # Drop the oldest speed
+    queue.put_nowait(fan_speed)
 
 
 async def get_fan_api():
@@ -31,9 +48,19 @@ async def get_fan_api():
     return api, fan
 
 
-api, fan = asyncio.run(get_fan_api())
+async def main():
+    api, fan = await get_fan_api()
+
+    if not fan:
+        raise ValueError("fan entity not found, check FAN_ENTITY config")
+
+    queue = asyncio.Queue(maxsize=4)
+
+    # A failure in either task ends main, asyncio.run cancels the other one.
+    await asyncio.gather(
+        fan_command_worker(api, fan, queue),
+        subscribe_speed_async(set_fan_speed, queue),
+    )
 
-if not fan:
-    raise ValueError("fan entity not found, check FAN_ENTITY config")
 
-subscribe_speed(set_fan_speed, api, fan)
+asyncio.run(main())
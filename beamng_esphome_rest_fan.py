@@ -7,13 +7,19 @@ from beamng_utils import subscribe_speed
 
 load_dotenv()
 
+# Keep the HTTP connection alive between commands.
+session = requests.Session()
+
+url = "http://{}/fan/{}/turn_on?speed_level=".format(
+    os.environ.get("ESP_IP"), os.environ.get("FAN_ENTITY")
+)
+
 
 def set_fan_speed(fan_speed):
-    requests.post(
-        "http://{}/fan/{}/turn_on?speed_level={}".format(
-            os.environ.get("ESP_IP"), os.environ.get("FAN_ENTITY"), fan_speed
-        )
-    )
+    try:
+        session.post(url + str(fan_speed), timeout=0.5)
+    except requests.RequestException as e:
+        print("Failed to send fan speed: {}".format(e))
 
 
 subscribe_speed(set_fan_speed)
@@ -1,41 +1,157 @@
+import asyncio
+import os
 import socket
 import struct
+import sys
 import time
 
+# Linux caps this to net.core.rmem_max (and reports it doubled).
+RECEIVE_BUFFER_SIZE = 4 * 1024 * 1024
 
-def subscribe_speed(callback, *args, **kwargs):
+# OutGauge packet layout, kept around in case other fields are needed later.
+OUTGAUGE = struct.Struct("<I4sH2c7f2I3f16s16si")
+
+# Speed (m/s) is the first float, right after time, car, flags and gear bytes.
+SPEED_OFFSET = struct.calcsize("<I4sH2c")
+SPEED = struct.Struct("<f")
+MIN_PACKET_SIZE = SPEED_OFFSET + SPEED.size
+
+# Bound once so the packet handler skips these lookups on every packet.
+unpack_speed = SPEED.unpack_from
+monotonic_ns = time.monotonic_ns
+
+# Fan speed starts at 1 when stopped and goes up by one step every 3 km/h.
+BASE_FAN_SPEED = 1
+MAX_FAN_SPEED = 100
+KMH_PER_FAN_STEP = 3
+
+# Minimum delay between two fan commands, in nanoseconds (0.3sec).
+COMMAND_COOLDOWN_NS = 300_000_000
+
+
+def create_outgauge_socket():
     # Create UDP socket.
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
+    # Enlarge the receive buffer so bursts don't get dropped by the kernel.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+    print(
+        "Receive buffer: {} bytes".format(
+            sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        )
+    )
+
     # Bind to BeamNG OutGauge.
     sock.bind(("0.0.0.0", 4444))
 
-    previous_fan_speed = 0
+    return sock
+
+
+def raise_priority():
+    # Opt-in, needs CAP_SYS_NICE (or root) and only works on Linux.
+    if os.environ.get("BEAMNG_RT") != "1" or not sys.platform.startswith("linux"):
+        return
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(20))
+        print("Scheduler: SCHED_FIFO")
+    except PermissionError:
+        try:
+            os.nice(-5)
+            print("Scheduler: nice -5")
+        except PermissionError:
+            print("Scheduler: missing CAP_SYS_NICE, keeping default priority")
+
+
+def calculate_fan_speed(speed):
+    return min(round(BASE_FAN_SPEED + speed / KMH_PER_FAN_STEP), MAX_FAN_SPEED)
+
+
+class OutGaugeProtocol(asyncio.DatagramProtocol):
+    def __init__(self, callback, *args, **kwargs):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
 
-    command_cooldown = time.time_ns()
+        self.previous_fan_speed = 0
 
-    while True:
-        # Receive data.
-        data = sock.recv(96)
+        self.command_cooldown = monotonic_ns()
 
-        if not data:
-            break  # Lost connection
+        # Latest speed received during the cooldown, sent once it expires.
+        self.pending_fan_speed = None
+        self.flush_handle = None
 
-        # Unpack the data.
-        outsim_pack = struct.unpack("I4sH2c7f2I3f16s16si", data)
+    def datagram_received(self, data, addr):
+        if len(data) < MIN_PACKET_SIZE:
+            return  # Truncated packet
 
-        speed = round(outsim_pack[5] * 3.6, 2)  # km/h
+        # Unpack the speed only.
+        speed = unpack_speed(data, SPEED_OFFSET)[0] * 3.6  # km/h
 
-        fan_speed = round(1 + speed / 3)
+        fan_speed = calculate_fan_speed(speed)
 
-        if fan_speed > 100:
-            fan_speed = 100
+        if fan_speed == self.previous_fan_speed:
+            # Back to the speed the fan already has, nothing left to send.
+            self.pending_fan_speed = None
+            self.cancel_flush()
+            return
 
-        if fan_speed != previous_fan_speed and command_cooldown < time.time_ns():
-            previous_fan_speed = fan_speed
-            command_cooldown = time.time_ns() + 300000000  # 0.3sec
-            callback(fan_speed, *args, **kwargs)
-            print("Fan speed: {}".format(fan_speed))
+        now = monotonic_ns()
 
-    # Release the socket.
-    sock.close()
+        if self.command_cooldown <= now:
+            self.send_fan_speed(fan_speed, now)
+            return
+
+        self.pending_fan_speed = fan_speed
+
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(
+                (self.command_cooldown - now) / 1e9, self.flush_pending
+            )
+
+    def connection_lost(self, exc):
+        self.cancel_flush()
+
+    def cancel_flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+    def flush_pending(self):
+        self.flush_handle = None
+
+        if self.pending_fan_speed is not None:
+            self.send_fan_speed(self.pending_fan_speed, monotonic_ns())
+
+    def send_fan_speed(self, fan_speed, now):
+        self.previous_fan_speed = fan_speed
+        self.command_cooldown = now + COMMAND_COOLDOWN_NS
+        self.pending_fan_speed = None
+        # A stale timer would otherwise cut the new cooldown short.
+        self.cancel_flush()
+        self.callback(fan_speed, *self.args, **self.kwargs)
+        print("Fan speed: {}".format(fan_speed))
+
+
+async def subscribe_speed_async(callback, *args, **kwargs):
+    # The callback runs on the current event loop.
+    raise_priority()
+
+    loop = asyncio.get_running_loop()
+
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: OutGaugeProtocol(callback, *args, **kwargs),
+        sock=create_outgauge_socket(),
+    )
+
+    try:
+        await asyncio.Future()  # Run until cancelled
+    finally:
+        # Release the socket.
+        transport.close()
+
+
+def subscribe_speed(callback, *args, **kwargs):
+    # Blocking version for synchronous callbacks, which simply hold up the loop
+    # while they run, like a plain recv loop would.
+    asyncio.run(subscribe_speed_async(callback, *args, **kwargs))